@@ -1,8 +1,40 @@
-import json
 from collections import Counter
 
-with open('rrweb-session-canvas.json', 'r') as f:
-    events = json.load(f)
+import ijson
+
+# Shared fallback for events without a 'data' field, so misses don't
+# allocate a fresh dict per event
+_EMPTY = {}
+
+# Stream events one at a time so the full parsed tree (including the large
+# base64 canvas payloads) is never held in memory, and bucket them in a
+# single pass. The file is opened in binary mode so ijson's C backend reads
+# raw bytes directly, and use_float skips building a Decimal per number.
+# Only counts and the first event of each kind (used as the printed example)
+# are kept.
+type_counts = Counter()
+source_counts = Counter()
+first_by_source = {}
+canvas_count = 0
+first_canvas = None
+
+with open('rrweb-session-canvas.json', 'rb') as f:
+    for e in ijson.items(f, 'item', use_float=True):
+        t = e['type']
+        type_counts[t] += 1
+        if t == 2:
+            continue
+        # Look up 'data' once per event rather than once per predicate
+        data = e.get('data') or _EMPTY
+        if t == 3:
+            source = data.get('source')
+            source_counts[source] += 1
+            if source not in first_by_source:
+                first_by_source[source] = e
+        elif t == 5 and data.get('tag') == 'canvas-snapshot':
+            canvas_count += 1
+            if first_canvas is None:
+                first_canvas = e
 
 print("=" * 60)
 print("RRWEB EVENT STRUCTURE ANALYSIS")
@@ -11,7 +43,6 @@ print("=" * 60)
 # Event type summary
 print("\n1. EVENT TYPE SUMMARY:")
 print("-" * 60)
-type_counts = Counter(e['type'] for e in events)
 type_names = {
     2: "FullSnapshot (DOM tree with node IDs)",
     3: "IncrementalSnapshot (user interactions)",
@@ -24,11 +55,10 @@ for t, count in sorted(type_counts.items()):
 # Click events
 print("\n2. CLICK EVENTS (Button clicks):")
 print("-" * 60)
-clicks = [e for e in events if e.get('type') == 3 and e.get('data', {}).get('source') == 2]
-print(f"   Total click events: {len(clicks)}")
-if clicks:
+print(f"   Total click events: {source_counts[2]}")
+c = first_by_source.get(2)
+if c:
     print("\n   Example click event:")
-    c = clicks[0]
     print(f"   - Timestamp: {c['timestamp']}")
     print(f"   - Node ID: {c['data'].get('id')} (identifies which element was clicked)")
     print(f"   - Position: x={c['data'].get('x')}, y={c['data'].get('y')}")
@@ -37,26 +67,25 @@ if clicks:
 # Mouse movements
 print("\n3. MOUSE MOVEMENT EVENTS:")
 print("-" * 60)
-moves = [e for e in events if e.get('type') == 3 and e.get('data', {}).get('source') == 1]
-print(f"   Total mouse move events: {len(moves)}")
-if moves:
-    print(f"   Example: Node ID={moves[0]['data'].get('id')}, Position: ({moves[0]['data']['positions'][0]['x']}, {moves[0]['data']['positions'][0]['y']})")
+print(f"   Total mouse move events: {source_counts[1]}")
+move = first_by_source.get(1)
+if move:
+    print(f"   Example: Node ID={move['data'].get('id')}, Position: ({move['data']['positions'][0]['x']}, {move['data']['positions'][0]['y']})")
 
 # Scroll events
 print("\n4. SCROLL EVENTS (zoom/pan):")
 print("-" * 60)
-scrolls = [e for e in events if e.get('type') == 3 and e.get('data', {}).get('source') == 3]
-print(f"   Total scroll events: {len(scrolls)}")
-if scrolls:
-    print(f"   Example: Node ID={scrolls[0]['data'].get('id')}, x={scrolls[0]['data'].get('x')}, y={scrolls[0]['data'].get('y')}")
+print(f"   Total scroll events: {source_counts[3]}")
+scroll = first_by_source.get(3)
+if scroll:
+    print(f"   Example: Node ID={scroll['data'].get('id')}, x={scroll['data'].get('x')}, y={scroll['data'].get('y')}")
 
 # Canvas snapshots
 print("\n5. CANVAS SNAPSHOT EVENTS (our custom):")
 print("-" * 60)
-canvas_events = [e for e in events if e.get('type') == 5 and e.get('data', {}).get('tag') == 'canvas-snapshot']
-print(f"   Total canvas snapshots: {len(canvas_events)}")
-if canvas_events:
-    snap = canvas_events[0]['data']['payload']['snapshots'][0]
+print(f"   Total canvas snapshots: {canvas_count}")
+if first_canvas:
+    snap = first_canvas['data']['payload']['snapshots'][0]
     print(f"   Example snapshot:")
     print(f"   - Canvas ID: {snap['id']}")
     print(f"   - Size: {snap['width']}x{snap['height']}")
@@ -65,8 +94,7 @@ if canvas_events:
 # Node ID mapping (from full snapshot)
 print("\n6. HOW COMPONENTS ARE IDENTIFIED:")
 print("-" * 60)
-full_snapshot = [e for e in events if e['type'] == 2]
-if full_snapshot:
+if type_counts[2]:
     print("   rrweb creates a DOM tree snapshot with unique node IDs:")
     print("   - Each HTML element gets a unique ID (e.g., button ID=234)")
     print("   - Interaction events reference these IDs")
@@ -1,13 +1,9 @@
-import io
-import json
 import logging
-import urllib.request
 
-import numpy as np
+import orjson
 import panel as pn
-from bokeh.models import WheelZoomTool, PanTool, ResetTool, BoxZoomTool
-from bokeh.plotting import figure
-from PIL import Image
+
+from common import JS_DEBUG_LOG, JS_LOADERS, JS_SHADOW_DOM, make_buttons, make_lazy_plot
 
 # Enhanced WebSocket logging with code explanations
 class WebSocketLogFilter(logging.Filter):
@@ -29,60 +25,62 @@ class WebSocketLogFilter(logging.Filter):
         1015: "TLS Handshake Failed - TLS/SSL handshake error",
     }
     
-    def filter(self, record):
-        # Check the unformatted message first to avoid formatting errors
-        original_msg = record.msg if isinstance(record.msg, str) else str(record.msg)
-        
-        # Enhance connection opened messages
-        if "WebSocket connection opened" in original_msg:
-            record.msg = "WebSocket connection opened - Client connected to server"
-            record.args = ()  # Clear args since we're replacing the message
-            return True
-        
-        # Enhance connection closed messages with code explanations
-        if "WebSocket connection closed" in original_msg:
-            # Extract code and reason from args if available
-            code = None
-            reason = None
-            
-            if record.args and len(record.args) >= 2:
-                code = record.args[0]
-                reason = record.args[1]
-            
-            # Build enhanced message
-            parts = ["WebSocket connection closed"]
-            
-            if code is not None and str(code) != 'None':
-                try:
-                    code_int = int(code) if not isinstance(code, int) else code
-                    explanation = self.CLOSE_CODES.get(code_int, f"Unknown code {code_int}")
-                    parts.append(f"[Code {code_int}: {explanation}]")
-                except (ValueError, TypeError):
-                    parts.append(f"[Code {code}]")
-            else:
-                parts.append("[No close code - likely client refresh/reload]")
-            
-            if reason and str(reason) != 'None':
-                parts.append(f"Reason: {reason}")
-            
-            record.msg = " ".join(parts)
-            record.args = ()  # Clear args since we're replacing the message
-            return True
+    def _on_opened(self, record):
+        """Enhance connection opened messages"""
+        record.msg = "WebSocket connection opened - Client connected to server"
+        record.args = ()  # Clear args since we're replacing the message
+
+    def _on_closed(self, record):
+        """Enhance connection closed messages with code explanations"""
+        # Extract code and reason from args if available
+        code = None
+        reason = None
+        
+        if record.args and len(record.args) >= 2:
+            code = record.args[0]
+            reason = record.args[1]
         
-        # Enhance ServerConnection messages
-        if "ServerConnection created" in original_msg:
-            record.msg = "ServerConnection created - New session established"
-            record.args = ()  # Clear args since we're replacing the message
-            return True
+        # Build enhanced message
+        parts = ["WebSocket connection closed"]
         
+        if code is not None and str(code) != 'None':
+            try:
+                code_int = int(code) if not isinstance(code, int) else code
+                explanation = self.CLOSE_CODES.get(code_int, f"Unknown code {code_int}")
+                parts.append(f"[Code {code_int}: {explanation}]")
+            except (ValueError, TypeError):
+                parts.append(f"[Code {code}]")
+        else:
+            parts.append("[No close code - likely client refresh/reload]")
+        
+        if reason and str(reason) != 'None':
+            parts.append(f"Reason: {reason}")
+        
+        record.msg = " ".join(parts)
+        record.args = ()  # Clear args since we're replacing the message
+
+    def _on_server_connection(self, record):
+        """Enhance ServerConnection messages"""
+        record.msg = "ServerConnection created - New session established"
+        record.args = ()  # Clear args since we're replacing the message
+
+    # Bokeh's messages start with fixed text, so a single dict lookup on the
+    # first _PREFIX_LEN characters replaces a substring scan per message type
+    _PREFIX_LEN = 24
+    _DISPATCH = {
+        "WebSocket connection opened"[:_PREFIX_LEN]: _on_opened,
+        "WebSocket connection closed"[:_PREFIX_LEN]: _on_closed,
+        "ServerConnection created"[:_PREFIX_LEN]: _on_server_connection,
+    }
+    
+    def filter(self, record):
+        # Check the unformatted message first to avoid formatting errors
+        msg = record.msg if type(record.msg) is str else str(record.msg)
+        handler = self._DISPATCH.get(msg[:self._PREFIX_LEN])
+        if handler is not None:
+            handler(self, record)
         return True
 
-# Apply the filter to Panel/Bokeh loggers
-websocket_filter = WebSocketLogFilter()
-for logger_name in ['bokeh.server.views.ws', 'tornado.access', 'panel', 'bokeh']:
-    logger = logging.getLogger(logger_name)
-    logger.addFilter(websocket_filter)
-
 # Configure logging format for better readability
 logging.basicConfig(
     format='%(asctime)s | %(message)s',
@@ -90,17 +88,22 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-# Load Panel + rrweb + rrweb-player + html2canvas from CDN
+# Apply the filter to the output handlers, so it runs once per emitted record
+# whichever Panel/Bokeh logger produced it. Bokeh keeps its own non-propagating
+# handler until `panel serve` configures logging, so cover that one too.
+# panel serve re-runs this script for every session, so skip handlers that
+# already carry a filter.
+websocket_filter = WebSocketLogFilter()
+for handler in logging.getLogger().handlers + logging.getLogger('bokeh').handlers:
+    if not any(type(f).__name__ == "WebSocketLogFilter" for f in handler.filters):
+        handler.addFilter(websocket_filter)
+
+# rrweb and rrweb-player are fetched by the Start and Replay handlers the first
+# time they are needed, so page loads that never record skip them.
 pn.extension(
   js_files={
-    "rrweb": "https://cdn.jsdelivr.net/npm/rrweb@latest/dist/rrweb.min.js",
-    "rrwebPlayer": "https://cdn.jsdelivr.net/npm/rrweb-player@latest/dist/index.js",
     "html2canvas": "https://cdn.jsdelivr.net/npm/html2canvas@1.4.1/dist/html2canvas.min.js",
   },
-  css_files=[
-    "https://cdn.jsdelivr.net/npm/rrweb@latest/dist/style.css",
-    "https://cdn.jsdelivr.net/npm/rrweb-player@latest/dist/style.css",
-  ],
 )
 
 # Configure Tornado to allow large WebSocket messages (for large rrweb JSON files)
@@ -110,64 +113,21 @@ pn.extension(
 print("[rrweb-demo] For large JSON files (>50MB), start server with: panel serve app.py --websocket-max-message-size=209715200")
 
 
-IMAGE_URL = "https://assets.holoviz.org/panel/tutorials/wind_turbine.png"
-
-# --- Load image from URL ---
-with urllib.request.urlopen(IMAGE_URL) as resp:
-    data = resp.read()
-
-img = Image.open(io.BytesIO(data)).convert("RGBA")
-arr = np.asarray(img)
-h, w = arr.shape[:2]
-
-rgba = np.flipud(arr).view(dtype=np.uint32).reshape((h, w))
-
-# --- Bokeh figure ---
-wheel_zoom = WheelZoomTool()
-pan = PanTool()
-box_zoom = BoxZoomTool()
-reset = ResetTool()
-
-p = figure(
-    title="Panel + Bokeh Image Viewer",
-    x_range=(0, w),
-    y_range=(0, h),
-    width=900,
-    height=650,
-    match_aspect=True,
-    toolbar_location="above",
-    tools="",
-)
-p.image_rgba(image=[rgba], x=0, y=0, dw=w, dh=h)
-p.add_tools(wheel_zoom, pan, box_zoom, reset)
-p.toolbar.active_scroll = wheel_zoom
-p.toolbar.active_drag = pan
-p.xaxis.visible = False
-p.yaxis.visible = False
-p.grid.visible = False
-
-plot = pn.pane.Bokeh(p, sizing_mode="stretch_both")
+plot = make_lazy_plot()
 
 # --- UI widgets ---
-start_btn = pn.widgets.Button(name="Start recording", button_type="success")
-stop_btn = pn.widgets.Button(name="Stop + download JSON", button_type="danger", disabled=True)
-replay_btn = pn.widgets.Button(name="Replay", button_type="primary", disabled=True)
-clear_btn = pn.widgets.Button(name="Clear", button_type="default", disabled=True)
+start_btn, stop_btn, replay_btn, clear_btn = make_buttons()
 
 file_input = pn.widgets.FileInput(name="Load saved rrweb JSON", accept=".json")
 
-events_json = pn.widgets.TextAreaInput(
-    name="Recorded events (JSON)",
-    placeholder="Click Start recording, interact (zoom/pan), then Stop.",
-    height=180,
+# Recordings stay in browser memory; only this short summary is synced
+events_summary = pn.pane.Markdown(
+    "Click Start recording, interact (zoom/pan), then Stop.",
     sizing_mode="stretch_width",
 )
 
 status = pn.pane.Markdown("**Status:** idle", sizing_mode="stretch_width")
 
-# Hidden HTML pane to inject JSON data (used as fallback if execute_script not available)
-json_injector = pn.pane.HTML("", width=0, height=0, sizing_mode="fixed")
-
 # --- JS callbacks (Panel expects JS strings) ---
 start_btn.js_on_click(
     args={
@@ -177,49 +137,11 @@ start_btn.js_on_click(
         "start_btn": start_btn,
         "status": status,
     },
-    code="""
-    console.log("[rrweb-demo] Start clicked");
-
-    const RRWEB_URL = "https://cdn.jsdelivr.net/npm/rrweb@latest/dist/rrweb.min.js";
-    const RRWEB_CSS = "https://cdn.jsdelivr.net/npm/rrweb@latest/dist/style.css";
-
-    function ensureCss(href) {
-      if ([...document.styleSheets].some(s => (s.href || "").includes(href))) return;
-      if (document.querySelector(`link[rel="stylesheet"][href="${href}"]`)) return;
-      const link = document.createElement("link");
-      link.rel = "stylesheet";
-      link.href = href;
-      document.head.appendChild(link);
-    }
-
-    function ensureScript(src, checkFn) {
-      return new Promise((resolve, reject) => {
-        try {
-          if (checkFn()) return resolve(true);
-          if (document.querySelector(`script[src="${src}"]`)) {
-            // already requested; wait a bit
-            const t0 = Date.now();
-            const tick = () => {
-              if (checkFn()) return resolve(true);
-              if (Date.now() - t0 > 8000) return reject(new Error("Timed out loading " + src));
-              setTimeout(tick, 100);
-            };
-            return tick();
-          }
-          const s = document.createElement("script");
-          s.src = src;
-          s.async = true;
-          s.onload = () => resolve(true);
-          s.onerror = () => reject(new Error("Failed to load " + src));
-          document.head.appendChild(s);
-        } catch (e) {
-          reject(e);
-        }
-      });
-    }
+    code=JS_DEBUG_LOG + JS_SHADOW_DOM + JS_LOADERS + """
+    log("[rrweb-demo] Start clicked");
 
     async function startRecording() {
-      window.__rrweb_state = window.__rrweb_state || { stopFn: null, events: [], canvasInterval: null };
+      window.__rrweb_state = window.__rrweb_state || { stopFn: null, events: [], canvasTimer: null };
 
       if (window.__rrweb_state.stopFn) {
         status.object = "**Status:** already recording";
@@ -231,39 +153,132 @@ start_btn.js_on_click(
         emit(event) {
           window.__rrweb_state.events.push(event);
         },
-        recordCanvas: true,
+        // The Bokeh layers are captured by the snapshot loop below, which
+        // looks inside Panel's shadow roots and skips unchanged frames, so
+        // rrweb's own canvas recording would only add a second copy
+        recordCanvas: false,
+        // Throttle high-frequency sources (mousemove at 20 Hz, scroll at ~7 Hz)
+        sampling: { mousemove: 50, mouseInteraction: true, scroll: 150, input: "last" },
       });
 
-      // Explicit canvas bitmap capture for Bokeh layers
+      // Explicit canvas bitmap capture for Bokeh layers. toBlob() encodes off
+      // the main thread and keeps raw JPEG bytes; toDataURL() blocked the page
+      // while encoding and base64-inflated every frame by a third.
       let canvasSnapshotCount = 0;
       let totalDataSize = 0;
-      window.__rrweb_state.canvasInterval = setInterval(() => {
+      // Per-snapshot log lines are buffered and flushed every LOG_EVERY ticks;
+      // with DevTools open each console.log costs enough to jitter the capture.
+      const LOG_EVERY = 5;
+      let tickCount = 0;
+      window.__rrweb_state.logBuf = [];
+      // WebP is markedly smaller than JPEG at the same quality; browsers that
+      // cannot encode it return PNG from toDataURL, so fall back to JPEG there.
+      window.__rrweb_state.snapshotType = window.__rrweb_state.snapshotType || (
+        document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp')
+          ? 'image/webp' : 'image/jpeg'
+      );
+      const encodeCanvas = (canvas) => new Promise((resolve) => {
+        canvas.toBlob(resolve, window.__rrweb_state.snapshotType, 0.6); // 60% quality
+      });
+
+      // Only re-encode layers whose pixels changed since their last snapshot.
+      // Every pixel is hashed: a downscaled copy samples only a few source
+      // pixels per tile, so thin or local changes could hash equal and leave
+      // a stale frame in the replay. The layer is copied to a CPU-backed
+      // scratch canvas first so reading it back never de-accelerates Bokeh's.
+      const scratch = document.createElement('canvas');
+      const scratchCtx = scratch.getContext('2d', { willReadFrequently: true });
+      const lastFingerprints = [];
+      const fingerprint = (canvas) => {
+        const { width, height } = canvas;
+        if (!width || !height) return '0x0';
+        if (scratch.width !== width || scratch.height !== height) {
+          scratch.width = width;
+          scratch.height = height;
+        } else {
+          scratchCtx.clearRect(0, 0, width, height);
+        }
+        scratchCtx.drawImage(canvas, 0, 0);
+        const px = new Uint32Array(scratchCtx.getImageData(0, 0, width, height).data.buffer);
+        let hash = 0x811c9dc5; // FNV-1a
+        for (let i = 0; i < px.length; i++) {
+          hash = Math.imul(hash ^ px[i], 0x01000193);
+        }
+        return `${canvas.width}x${canvas.height}:${hash >>> 0}`;
+      };
+
+      const encodeLayer = async (canvas, idx) => {
         try {
-          const canvases = document.querySelectorAll('canvas.bk-layer');
-          if (!canvases || canvases.length === 0) return;
-          
-          const snapshots = [];
-          canvases.forEach((canvas, idx) => {
-            try {
-              // Try to capture canvas bitmap with lower quality to reduce size
-              const dataURL = canvas.toDataURL('image/jpeg', 0.6); // JPEG at 60% quality
-              const sizeKB = Math.round(dataURL.length / 1024);
-              totalDataSize += dataURL.length;
-              
-              snapshots.push({
-                index: idx,
-                width: canvas.width,
-                height: canvas.height,
-                dataURL: dataURL,
-                sizeKB: sizeKB,
-                id: canvas.getAttribute('data-canvas-id') || `bokeh-canvas-${idx}`
-              });
-            } catch (e) {
-              console.warn(`[rrweb-demo] Canvas ${idx} tainted or failed:`, e.message);
-            }
-          });
+          const fp = fingerprint(canvas);
+          if (fp === lastFingerprints[idx]) return null;
+          const blob = await encodeCanvas(canvas);
+          if (!blob) return null;
+          lastFingerprints[idx] = fp;
+          totalDataSize += blob.size;
+
+          return {
+            index: idx,
+            width: canvas.width,
+            height: canvas.height,
+            blob: blob,
+            sizeKB: Math.round(blob.size / 1024),
+            id: canvas.getAttribute('data-canvas-id') || `bokeh-canvas-${idx}`
+          };
+        } catch (e) {
+          console.warn(`[rrweb-demo] Canvas ${idx} tainted or failed:`, e.message);
+          return null;
+        }
+      };
+
+      // Bokeh's layer canvases rarely change during a recording, so the list
+      // is cached and only re-collected after the DOM has been mutated. The
+      // canvases live in shadow roots, so every root found is observed too.
+      let canvasesDirty = true;
+      window.__rrweb_state.canvases = [];
+      window.__rrweb_state.mo = new MutationObserver(() => { canvasesDirty = true; });
+      const refreshCanvases = () => {
+        const roots = shadowRoots(document);
+        const canvases = [];
+        for (const root of roots) {
+          window.__rrweb_state.mo.observe(root, { childList: true, subtree: true });
+          canvases.push(...root.querySelectorAll('canvas.bk-layer'));
+        }
+        window.__rrweb_state.canvases = canvases;
+        canvasesDirty = false;
+        log("[rrweb-demo] Found", canvases.length, "Bokeh canvas layer(s) in", roots.length, "DOM root(s)");
+      };
+
+      // Captures are due CAPTURE_EVERY_MS after the previous one started. Each
+      // waits up to IDLE_WAIT_MS for an idle slot, and the next one is only
+      // scheduled after it finishes, so slow encodes never pile up behind a
+      // fixed interval. Hidden tabs skip capturing altogether.
+      const CAPTURE_EVERY_MS = 1000;
+      const IDLE_WAIT_MS = 100;
+      const stopThis = window.__rrweb_state.stopFn;
+      const stillRecording = () => window.__rrweb_state.stopFn === stopThis;
+      const whenIdle = window.requestIdleCallback
+        ? (fn) => requestIdleCallback(fn, { timeout: IDLE_WAIT_MS })
+        : (fn) => setTimeout(fn, 0);
+      const captureSnapshots = async () => {
+        try {
+          if (++tickCount % LOG_EVERY === 0 && window.__rrweb_state.logBuf.length) {
+            log("[rrweb-demo] batch:", JSON.stringify(window.__rrweb_state.logBuf));
+            window.__rrweb_state.logBuf.length = 0;
+          }
+          if (canvasesDirty) refreshCanvases();
+          const canvases = window.__rrweb_state.canvases;
+          if (canvases.length === 0) return;
+
+          const pending = [];
+          for (let i = 0; i < canvases.length; i++) {
+            pending.push(encodeLayer(canvases[i], i));
+          }
+          const encoded = await Promise.all(pending);
+          // Unchanged layers are left out; the replay hook restores by index
+          const snapshots = encoded.filter(Boolean);
           
-          if (snapshots.length > 0) {
+          // Nothing changed, or recording was stopped while frames were encoding
+          if (snapshots.length > 0 && stillRecording()) {
             // Push custom event (type 5) with canvas snapshots
             window.__rrweb_state.events.push({
               type: 5, // Custom event
@@ -278,12 +293,29 @@ start_btn.js_on_click(
             });
             canvasSnapshotCount++;
             const totalSizeKB = Math.round(snapshots.reduce((sum, s) => sum + s.sizeKB, 0));
-            console.log(`[rrweb-demo] Snapshot ${canvasSnapshotCount}: ${snapshots.length} canvases, ${totalSizeKB}KB (total: ${Math.round(totalDataSize/1024)}KB)`);
+            if (DEBUG) {
+              window.__rrweb_state.logBuf.push({
+                n: canvasSnapshotCount,
+                canvases: snapshots.length,
+                sizeKB: totalSizeKB,
+                totalKB: Math.round(totalDataSize / 1024),
+              });
+            }
           }
         } catch (e) {
           console.error('[rrweb-demo] Canvas capture error:', e);
         }
-      }, 1000); // Capture every 1 second (reduced from 200ms)
+      };
+      const scheduleCapture = (due) => {
+        const delay = Math.max(0, due - performance.now() - IDLE_WAIT_MS);
+        window.__rrweb_state.canvasTimer = setTimeout(() => whenIdle(async () => {
+          if (!stillRecording()) return;
+          const started = performance.now();
+          if (document.visibilityState === 'visible') await captureSnapshots();
+          if (stillRecording()) scheduleCapture(started + CAPTURE_EVERY_MS);
+        }), delay);
+      };
+      scheduleCapture(performance.now() + CAPTURE_EVERY_MS);
 
       status.object = "**Status:** 🔴 recording... (zoom/pan now)";
       start_btn.name = "Recording…";
@@ -293,7 +325,7 @@ start_btn.js_on_click(
       replay_btn.disabled = true;
       clear_btn.disabled = true;
 
-      console.log("[rrweb-demo] Recording started with canvas capture");
+      log("[rrweb-demo] Recording started with canvas capture");
     }
 
     (async () => {
@@ -320,15 +352,15 @@ start_btn.js_on_click(
 
 stop_btn.js_on_click(
     args={
-        "events_json": events_json,
+        "events_summary": events_summary,
         "stop_btn": stop_btn,
         "replay_btn": replay_btn,
         "clear_btn": clear_btn,
         "start_btn": start_btn,
         "status": status,
     },
-    code="""
-    console.log("[rrweb-demo] Stop clicked");
+    code=JS_DEBUG_LOG + """
+    log("[rrweb-demo] Stop clicked");
 
     if (!window.__rrweb_state || !window.__rrweb_state.stopFn) {
       status.object = "**Status:** not recording";
@@ -339,33 +371,90 @@ stop_btn.js_on_click(
     window.__rrweb_state.stopFn = null;
     
     // Stop canvas capture interval
-    if (window.__rrweb_state.canvasInterval) {
-      clearInterval(window.__rrweb_state.canvasInterval);
-      window.__rrweb_state.canvasInterval = null;
-      console.log('[rrweb-demo] Canvas capture interval cleared');
+    if (window.__rrweb_state.canvasTimer) {
+      clearTimeout(window.__rrweb_state.canvasTimer);
+      window.__rrweb_state.canvasTimer = null;
+      log('[rrweb-demo] Canvas capture stopped');
+    }
+    if (window.__rrweb_state.mo) {
+      window.__rrweb_state.mo.disconnect();
+      window.__rrweb_state.mo = null;
+    }
+    window.__rrweb_state.canvases = [];
+    if (window.__rrweb_state.logBuf && window.__rrweb_state.logBuf.length) {
+      log("[rrweb-demo] batch:", JSON.stringify(window.__rrweb_state.logBuf));
+      window.__rrweb_state.logBuf.length = 0;
     }
 
     const events = window.__rrweb_state.events || [];
-    const json = JSON.stringify(events);
-    const sizeKB = Math.round(json.length / 1024);
-    const sizeMB = (sizeKB / 1024).toFixed(2);
-
-    // Show summary only (don't send full JSON via WebSocket - would exceed message limit!)
-    const summary = `Recorded: ${events.length} events, ${sizeMB}MB\n(JSON kept in browser memory, downloaded to file)`;
-    events_json.value = summary;
-
-    // download JSON
-    const blob = new Blob([json], { type: "application/json" });
-    const url = URL.createObjectURL(blob);
-    const a = document.createElement("a");
-    a.href = url;
-    a.download = "rrweb-session.json";
-    document.body.appendChild(a);
-    a.click();
-    a.remove();
-    URL.revokeObjectURL(url);
-
-    status.object = `**Status:** stopped (${events.length} events, ${sizeMB}MB) ✅`;
+
+    function blobToDataURL(blob) {
+      return new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = () => resolve(reader.result);
+        reader.onerror = () => reject(reader.error);
+        reader.readAsDataURL(blob);
+      });
+    }
+
+    // Canvas snapshots stay Blobs in memory (replay draws them directly); the
+    // JSON file needs them inline, so each event's snapshots are base64-encoded
+    // right before that event is stringified and released right after.
+    // Events are folded into the Blob every BLOB_BATCH events, so neither the
+    // whole recording nor all of its base64 is ever held as strings at once.
+    const BLOB_BATCH = 500;
+    async function serializeEvents() {
+      const dataURLs = new Map();
+      const replacer = (key, value) => {
+        if (!dataURLs.has(value)) return value;
+        const { blob, ...snap } = value;
+        return { ...snap, dataURL: dataURLs.get(value) };
+      };
+      let blob = new Blob(["["]);
+      let parts = [];
+      for (let i = 0; i < events.length; i++) {
+        const e = events[i];
+        if (e.type === 5 && e.data && e.data.tag === 'canvas-snapshot') {
+          for (const snap of e.data.payload.snapshots || []) {
+            if (snap.blob) dataURLs.set(snap, await blobToDataURL(snap.blob));
+          }
+        }
+        parts.push((i ? "," : "") + JSON.stringify(e, replacer));
+        dataURLs.clear();
+        if (parts.length === BLOB_BATCH) {
+          blob = new Blob([blob, ...parts]);
+          parts = [];
+        }
+      }
+      parts.push("]");
+      return new Blob([blob, ...parts], { type: "application/json" });
+    }
+
+    async function saveEvents() {
+      status.object = "**Status:** saving recording…";
+      const blob = await serializeEvents();
+      const sizeKB = Math.round(blob.size / 1024);
+      const sizeMB = (sizeKB / 1024).toFixed(2);
+
+      // The snapshot count is the quick check that the plot was captured
+      const snapshotCount = events.filter(
+        (e) => e.type === 5 && e.data && e.data.tag === 'canvas-snapshot'
+      ).length;
+      events_summary.object = `Recorded: ${events.length} events (${snapshotCount} canvas snapshots), ${sizeMB}MB (kept in browser memory, downloaded to file)`;
+
+      // download JSON
+      const url = URL.createObjectURL(blob);
+      const a = document.createElement("a");
+      a.href = url;
+      a.download = "rrweb-session.json";
+      document.body.appendChild(a);
+      a.click();
+      a.remove();
+      URL.revokeObjectURL(url);
+
+      status.object = `**Status:** stopped (${events.length} events, ${sizeMB}MB) ✅`;
+    }
+
     start_btn.name = "Start recording";
     start_btn.button_type = "success";
 
@@ -373,82 +462,31 @@ stop_btn.js_on_click(
     replay_btn.disabled = (events.length === 0);
     clear_btn.disabled = (events.length === 0);
 
-    console.log("[rrweb-demo] Stopped. Events:", events.length);
+    saveEvents().catch((e) => {
+      console.error("[rrweb-demo] Failed to save recording", e);
+      status.object = "**Status:** failed to save recording (see Console)";
+    });
+
+    log("[rrweb-demo] Stopped. Events:", events.length);
     """
 )
 
 
 replay_btn.js_on_click(
-    args={"events_json": events_json, "status": status},
-    code="""
-    console.log("[rrweb-demo] Replay clicked");
-    console.log("[rrweb-demo] window.rrwebPlayer available?", typeof window.rrwebPlayer);
-
-    const RRWEB_PLAYER_URL = "https://cdn.jsdelivr.net/npm/rrweb-player@latest/dist/index.js";
-    const RRWEB_PLAYER_CSS = "https://cdn.jsdelivr.net/npm/rrweb-player@latest/dist/style.css";
-
-    function ensureCss(href) {
-      if ([...document.styleSheets].some(s => (s.href || "").includes(href))) return;
-      if (document.querySelector(`link[rel="stylesheet"][href="${href}"]`)) return;
-      const link = document.createElement("link");
-      link.rel = "stylesheet";
-      link.href = href;
-      document.head.appendChild(link);
-      console.log("[rrweb-demo] Added CSS:", href);
-    }
-
-    function ensureScript(src, checkFn) {
-      return new Promise((resolve, reject) => {
-        try {
-          if (checkFn()) {
-            console.log("[rrweb-demo] Script already loaded:", src);
-            return resolve(true);
-          }
-          if (document.querySelector(`script[src="${src}"]`)) {
-            console.log("[rrweb-demo] Script tag exists, waiting for load:", src);
-            const t0 = Date.now();
-            const tick = () => {
-              if (checkFn()) {
-                console.log("[rrweb-demo] Script now available:", src);
-                return resolve(true);
-              }
-              if (Date.now() - t0 > 8000) {
-                console.error("[rrweb-demo] Timeout loading:", src);
-                return reject(new Error("Timed out loading " + src));
-              }
-              setTimeout(tick, 100);
-            };
-            return tick();
-          }
-          console.log("[rrweb-demo] Loading script:", src);
-          const s = document.createElement("script");
-          s.src = src;
-          s.async = true;
-          s.onload = () => {
-            console.log("[rrweb-demo] Script loaded successfully:", src);
-            resolve(true);
-          };
-          s.onerror = () => {
-            console.error("[rrweb-demo] Failed to load script:", src);
-            reject(new Error("Failed to load " + src));
-          };
-          document.head.appendChild(s);
-        } catch (e) {
-          console.error("[rrweb-demo] Error in ensureScript:", e);
-          reject(e);
-        }
-      });
-    }
+    args={"status": status},
+    code=JS_DEBUG_LOG + JS_SHADOW_DOM + JS_LOADERS + """
+    log("[rrweb-demo] Replay clicked");
+    log("[rrweb-demo] window.rrwebPlayer available?", typeof window.rrwebPlayer);
 
     async function doReplay() {
-      console.log("[rrweb-demo] doReplay started");
+      log("[rrweb-demo] doReplay started");
       
       if (typeof window.rrwebPlayer !== "function") {
         status.object = "**Status:** loading rrweb-player…";
-        console.log("[rrweb-demo] rrwebPlayer not found, loading from CDN");
+        log("[rrweb-demo] rrwebPlayer not found, loading from CDN");
         ensureCss(RRWEB_PLAYER_CSS);
         await ensureScript(RRWEB_PLAYER_URL, () => typeof window.rrwebPlayer === "function");
-        console.log("[rrweb-demo] After ensureScript, rrwebPlayer type:", typeof window.rrwebPlayer);
+        log("[rrweb-demo] After ensureScript, rrwebPlayer type:", typeof window.rrwebPlayer);
       }
 
       if (typeof window.rrwebPlayer !== "function") {
@@ -458,37 +496,29 @@ replay_btn.js_on_click(
         return;
       }
 
-      let events = [];
-      try {
-        // Try browser memory first (if we just recorded)
-        if (window.__rrweb_state && window.__rrweb_state.events && window.__rrweb_state.events.length > 0) {
-          events = window.__rrweb_state.events;
-          console.log("[rrweb-demo] Using events from browser memory:", events.length);
-        } else {
-          // Try parsing from widget (for uploaded files)
-          events = JSON.parse(events_json.value || "[]");
-          console.log("[rrweb-demo] Parsed events from widget:", events.length);
-        }
-      } catch (e) {
-        status.object = "**Status:** no events available (upload JSON file or record first)";
-        console.error("[rrweb-demo] No events available:", e);
-        return;
+      // An uploaded file may still be being parsed by the browser
+      if (window.__rrweb_state && window.__rrweb_state.loading) {
+        await window.__rrweb_state.loading;
       }
 
+      // Recordings and uploads both land in browser memory
+      const events = (window.__rrweb_state && window.__rrweb_state.events) || [];
+      log("[rrweb-demo] Using events from browser memory:", events.length);
+
       if (!events.length) {
-        status.object = "**Status:** no events to replay";
+        status.object = "**Status:** no events in browser memory (record or re-upload a JSON file)";
         console.warn("[rrweb-demo] No events to replay");
         return;
       }
 
       status.object = `**Status:** mounting player (events: ${events.length})…`;
-      console.log("[rrweb-demo] Setting up replay container");
+      log("[rrweb-demo] Setting up replay container");
       
       // Create or find container at the document body level (bypass Panel isolation)
       let root = document.getElementById("rrweb-replay-root");
       
       if (!root) {
-        console.log("[rrweb-demo] Creating replay root at document.body level");
+        log("[rrweb-demo] Creating replay root at document.body level");
         
         // Create a fixed-position overlay container
         const overlay = document.createElement('div');
@@ -579,21 +609,21 @@ replay_btn.js_on_click(
               URL.revokeObjectURL(url);
               
               status.object = '**Status:** ✅ video downloaded! (' + sizeMB + 'MB)';
-              console.log('[rrweb-demo] Video file downloaded');
+              log('[rrweb-demo] Video file downloaded');
             };
           }
         };
         
         setupVideoButtons();
         
-        console.log("[rrweb-demo] Created overlay replay container");
+        log("[rrweb-demo] Created overlay replay container");
       } else {
-        console.log("[rrweb-demo] Reusing existing replay root");
+        log("[rrweb-demo] Reusing existing replay root");
       }
       
       // Function to start video recording (called manually by button)
       function startVideoRecording(onComplete) {
-        console.log('[rrweb-demo] Starting video recording...');
+        log('[rrweb-demo] Starting video recording...');
         
         // Check if html2canvas is loaded
         if (typeof html2canvas !== 'function') {
@@ -628,7 +658,7 @@ replay_btn.js_on_click(
         canvas.width = width;
         canvas.height = height;
         
-        console.log('[rrweb-demo] Recording canvas created:', width, 'x', height);
+        log('[rrweb-demo] Recording canvas created:', width, 'x', height);
         
         // Get canvas stream for recording
         const stream = canvas.captureStream(30); // 30 fps
@@ -650,7 +680,7 @@ replay_btn.js_on_click(
         const durationMs = metadata.totalTime || 30000;
         const durationSec = Math.ceil(durationMs / 1000);
         
-        console.log('[rrweb-demo] Recording for', durationSec, 'seconds');
+        log('[rrweb-demo] Recording for', durationSec, 'seconds');
         
         // Capture frames from replay
         let frameCount = 0;
@@ -678,7 +708,7 @@ replay_btn.js_on_click(
             
             frameCount++;
             if (frameCount % 30 === 0) {
-              console.log('[rrweb-demo] Recorded', frameCount, 'frames');
+              log('[rrweb-demo] Recorded', frameCount, 'frames');
             }
           } catch (e) {
             console.warn('[rrweb-demo] Frame capture error:', e);
@@ -704,7 +734,7 @@ replay_btn.js_on_click(
           window.__rrweb_video_state.isRecording = false;
           
           const sizeMB = (blob.size / 1024 / 1024).toFixed(2);
-          console.log('[rrweb-demo] Video recording complete:', sizeMB, 'MB,', frameCount, 'frames');
+          log('[rrweb-demo] Video recording complete:', sizeMB, 'MB,', frameCount, 'frames');
           status.object = '**Status:** ✅ video ready to download! (' + sizeMB + 'MB)';
           
           // Call completion callback to update UI
@@ -729,7 +759,7 @@ replay_btn.js_on_click(
       root.style.background = "#fff";
 
       if (window.__rrweb_player) {
-        console.log("[rrweb-demo] Destroying existing player");
+        log("[rrweb-demo] Destroying existing player");
         try {
           const rep = window.__rrweb_player.getReplayer ? window.__rrweb_player.getReplayer() : null;
           if (rep && rep.destroy) rep.destroy();
@@ -740,7 +770,7 @@ replay_btn.js_on_click(
       }
 
       status.object = `**Status:** replaying (events: ${events.length}) ▶️`;
-      console.log("[rrweb-demo] Creating new rrwebPlayer with config:", {
+      log("[rrweb-demo] Creating new rrwebPlayer with config:", {
         events: events.length,
         width: root.clientWidth || 1000,
         height: root.clientHeight || 600
@@ -748,7 +778,7 @@ replay_btn.js_on_click(
       
       // Count canvas snapshot events
       const canvasEvents = events.filter(e => e.type === 5 && e.data && e.data.tag === 'canvas-snapshot');
-      console.log(`[rrweb-demo] Found ${canvasEvents.length} canvas snapshot events`);
+      log(`[rrweb-demo] Found ${canvasEvents.length} canvas snapshot events`);
       
       // Initialize video recording state
       window.__rrweb_video_state = {
@@ -766,16 +796,21 @@ replay_btn.js_on_click(
             showController: true,
             width: root.clientWidth || 1000,
             height: root.clientHeight || 600,
+            // New recordings carry no rrweb canvas data, but uploaded or
+            // bundled older ones do, and need this to replay it
             UNSAFE_replayCanvas: true,
           },
         });
-        console.log("[rrweb-demo] Player created successfully", window.__rrweb_player);
+        log("[rrweb-demo] Player created successfully", window.__rrweb_player);
         
         // Hook into replayer to restore canvas snapshots
         try {
           const replayer = window.__rrweb_player.getReplayer();
           if (replayer) {
             let lastCanvasRestore = 0;
+            // Decodes finish out of order, so only the newest one per layer paints
+            let restoreSeq = 0;
+            const layerSeq = [];
             replayer.on('event-cast', (event) => {
               if (event.type === 5 && event.data && event.data.tag === 'canvas-snapshot') {
                 const snapshots = event.data.payload.snapshots || [];
@@ -785,28 +820,38 @@ replay_btn.js_on_click(
                 const replayDoc = iframe.contentDocument || iframe.contentWindow.document;
                 if (!replayDoc) return;
                 
+                // rrweb rebuilds Bokeh's shadow roots inside the replay iframe
+                const canvases = queryAllDOMs(replayDoc, 'canvas.bk-layer');
                 snapshots.forEach(snapshot => {
-                  const canvases = replayDoc.querySelectorAll('canvas.bk-layer');
                   if (canvases[snapshot.index]) {
                     const canvas = canvases[snapshot.index];
                     const ctx = canvas.getContext('2d');
                     if (ctx) {
-                      const img = new Image();
-                      img.onload = () => {
-                        ctx.clearRect(0, 0, canvas.width, canvas.height);
-                        ctx.drawImage(img, 0, 0);
-                        lastCanvasRestore++;
-                        if (lastCanvasRestore % 10 === 0) {
-                          console.log(`[rrweb-demo] Restored ${lastCanvasRestore} canvas snapshots`);
+                      const seq = layerSeq[snapshot.index] = ++restoreSeq;
+                      // Freshly recorded snapshots hold a Blob; uploaded ones a data URL.
+                      // createImageBitmap decodes off the main thread, unlike <img>.
+                      const blob = snapshot.blob
+                        ? Promise.resolve(snapshot.blob)
+                        : fetch(snapshot.dataURL).then(r => r.blob());
+                      blob.then(b => createImageBitmap(b)).then(bitmap => {
+                        if (layerSeq[snapshot.index] === seq) {
+                          ctx.clearRect(0, 0, canvas.width, canvas.height);
+                          ctx.drawImage(bitmap, 0, 0);
+                          lastCanvasRestore++;
+                          if (lastCanvasRestore % 10 === 0) {
+                            log(`[rrweb-demo] Restored ${lastCanvasRestore} canvas snapshots`);
+                          }
                         }
-                      };
-                      img.src = snapshot.dataURL;
+                        bitmap.close();
+                      }).catch(err => {
+                        console.warn(`[rrweb-demo] Could not restore canvas ${snapshot.index}:`, err);
+                      });
                     }
                   }
                 });
               }
             });
-            console.log('[rrweb-demo] Canvas restoration hook installed');
+            log('[rrweb-demo] Canvas restoration hook installed');
           }
         } catch (hookErr) {
           console.warn('[rrweb-demo] Could not install canvas restoration hook:', hookErr);
@@ -824,7 +869,7 @@ replay_btn.js_on_click(
     (async () => {
       try {
         await doReplay();
-        console.log("[rrweb-demo] Replay sequence completed");
+        log("[rrweb-demo] Replay sequence completed");
       } catch (e) {
         console.error("[rrweb-demo] Replay failed at top level", e);
         console.error("[rrweb-demo] Error stack:", e.stack);
@@ -836,9 +881,9 @@ replay_btn.js_on_click(
 
 
 clear_btn.js_on_click(
-    args={"events_json": events_json, "replay_btn": replay_btn, "clear_btn": clear_btn, "status": status},
+    args={"events_summary": events_summary, "replay_btn": replay_btn, "clear_btn": clear_btn, "status": status},
     code="""
-    events_json.value = "No events recorded";
+    events_summary.object = "No events recorded";
     replay_btn.disabled = true;
     clear_btn.disabled = true;
 
@@ -866,76 +911,66 @@ clear_btn.js_on_click(
 )
 
 
+# Parse uploads in the browser, which already holds the file, instead of
+# sending the whole recording back over the WebSocket from Python
+file_input.jscallback(
+    value=JS_DEBUG_LOG + """
+    const b64 = cb_obj.value;
+    if (!b64) return;
+
+    window.__rrweb_state = window.__rrweb_state || {};
+    window.__rrweb_state.events = [];
+    // fetch() decodes the data URL natively and Response.json() parses it in
+    // one pass; replay waits on this promise if it is still running. Only the
+    // latest upload may store events or clear the promise, so a slow parse of
+    // an earlier file cannot overwrite a newer one.
+    const p = fetch("data:application/json;base64," + b64)
+      .then((resp) => resp.json())
+      .then((events) => {
+        if (window.__rrweb_state.loading !== p) return;
+        window.__rrweb_state.events = Array.isArray(events) ? events : [];
+        log('[rrweb-demo] Loaded', window.__rrweb_state.events.length, 'events from file into browser memory');
+      })
+      .catch((e) => {
+        console.error('[rrweb-demo] Failed to parse uploaded JSON in the browser', e);
+      })
+      .finally(() => {
+        if (window.__rrweb_state.loading === p) window.__rrweb_state.loading = null;
+      });
+    window.__rrweb_state.loading = p;
+    """,
+)
+
+
 def _load_rrweb_json(event):
     if not event.new:
         return
-    try:
-        text = event.new.decode("utf-8")
-    except Exception:
-        text = ""
     
-    # Store uploaded JSON in browser memory for replay (avoid WebSocket size limits)
-    if text.strip():
+    # The browser keeps its own parsed copy for replay (see the jscallback
+    # above), so the upload is only validated and summarized here
+    if event.new.strip():
         try:
-            parsed = json.loads(text)
+            # Parse only to validate and count events; orjson does it in native
+            # code and the parsed tree is dropped right away
+            parsed = orjson.loads(event.new)
             event_count = len(parsed) if isinstance(parsed, list) else None
+            del parsed
             
             # Show summary (don't send full JSON via WebSocket - would exceed message limit!)
-            sizeKB = round(len(text) / 1024)
+            sizeKB = round(len(event.new) / 1024)
             sizeMB = round(sizeKB / 1024, 2)
-            summary = f"Uploaded: {event_count} events, {sizeMB}MB\n(JSON stored in browser memory for replay)"
-            events_json.value = summary
-            
-            # Store in browser memory via JS execution
-            # Use json.dumps to safely escape the parsed JSON for embedding in JS
-            json_safe = json.dumps(parsed)
-            
-            # Try multiple methods to inject JSON into browser memory
-            injection_success = False
-            try:
-                # Method 1: Use pn.state.execute_script if available (Panel 1.0+)
-                if hasattr(pn.state, 'execute_script'):
-                    pn.state.execute_script(f"""
-                        window.__rrweb_state = window.__rrweb_state || {{}};
-                        window.__rrweb_state.events = {json_safe};
-                        console.log('[rrweb-demo] Loaded', {event_count}, 'events from file into browser memory via execute_script');
-                    """)
-                    print(f"[rrweb-demo] Injected {event_count} events into browser memory via execute_script")
-                    injection_success = True
-                # Method 2: Use HTML pane with inline script as fallback
-                else:
-                    # Update the hidden HTML injector pane with a script that loads the data
-                    json_injector.object = f"""
-                        <script>
-                        (function() {{
-                            window.__rrweb_state = window.__rrweb_state || {{}};
-                            window.__rrweb_state.events = {json_safe};
-                            console.log('[rrweb-demo] Loaded', {event_count}, 'events from file into browser memory via HTML injector');
-                        }})();
-                        </script>
-                    """
-                    print(f"[rrweb-demo] Set HTML injector for {event_count} events (fallback method)")
-                    injection_success = True
-            except Exception as js_err:
-                print(f"[rrweb-demo] Failed to inject JSON into browser memory: {js_err}")
-                injection_success = False
-            
-            if not injection_success:
-                # If injection fails, the replay button will try to parse from events_json
-                # but this will fail for large files due to WebSocket limits
-                status.object = f"**Status:** loaded {event_count} events ({sizeMB}MB) - Warning: may not replay properly for large files"
-                return
+            events_summary.object = f"Uploaded: {event_count} events, {sizeMB}MB (stored in browser memory for replay)"
             
             replay_btn.disabled = False
             clear_btn.disabled = False
             status.object = f"**Status:** loaded {event_count} events ({sizeMB}MB)"
         except Exception as e:
-            events_json.value = "Failed to parse uploaded JSON"
+            events_summary.object = "Failed to parse uploaded JSON"
             status.object = f"**Status:** file load failed - {str(e)}"
             replay_btn.disabled = True
             clear_btn.disabled = True
     else:
-        events_json.value = ""
+        events_summary.object = ""
         status.object = "**Status:** file load failed - empty file"
         replay_btn.disabled = True
         clear_btn.disabled = True
@@ -949,11 +984,10 @@ controls = pn.Row(start_btn, stop_btn, replay_btn, clear_btn, file_input, sizing
 pn.template.FastListTemplate(
     title="Panel + Bokeh + rrweb (minimal demo)",
     main=[
-        json_injector,  # Hidden HTML pane for JS injection (fallback method)
         controls,
         status,
         plot,
-        events_json,
+        events_summary,
     ],
 ).servable()
 
@@ -1,67 +1,19 @@
-import io
-import urllib.request
-
-import numpy as np
 import panel as pn
-from bokeh.models import WheelZoomTool, PanTool, ResetTool, BoxZoomTool
-from bokeh.plotting import figure
-from PIL import Image
-
-# Load Panel and rrweb from CDN
-pn.extension(
-    js_files={"rrweb": "https://cdn.jsdelivr.net/npm/rrweb@latest/dist/rrweb.min.js"},
-    css_files=["https://cdn.jsdelivr.net/npm/rrweb@latest/dist/rrweb.min.css"],
-)
-
-
-IMAGE_URL = "https://assets.holoviz.org/panel/tutorials/wind_turbine.png"
 
-# --- Load image from URL ---
-with urllib.request.urlopen(IMAGE_URL) as resp:
-    data = resp.read()
+from common import JS_DEBUG_LOG, JS_LOADERS, JS_SHADOW_DOM, make_buttons, make_lazy_plot
 
-img = Image.open(io.BytesIO(data)).convert("RGBA")
-arr = np.asarray(img)
-h, w = arr.shape[:2]
+# rrweb itself is loaded from the CDN on the first Start click (see below)
+pn.extension()
 
-rgba = np.flipud(arr).view(dtype=np.uint32).reshape((h, w))
 
-# --- Bokeh figure ---
-wheel_zoom = WheelZoomTool()
-pan = PanTool()
-box_zoom = BoxZoomTool()
-reset = ResetTool()
-
-p = figure(
-    title="Panel + Bokeh Image Viewer",
-    x_range=(0, w),
-    y_range=(0, h),
-    width=900,
-    height=650,
-    match_aspect=True,
-    toolbar_location="above",
-    tools="",
-)
-p.image_rgba(image=[rgba], x=0, y=0, dw=w, dh=h)
-p.add_tools(wheel_zoom, pan, box_zoom, reset)
-p.toolbar.active_scroll = wheel_zoom
-p.toolbar.active_drag = pan
-p.xaxis.visible = False
-p.yaxis.visible = False
-p.grid.visible = False
-
-plot = pn.pane.Bokeh(p, sizing_mode="stretch_both")
+plot = make_lazy_plot()
 
 # --- UI widgets ---
-start_btn = pn.widgets.Button(name="Start recording", button_type="success")
-stop_btn = pn.widgets.Button(name="Stop + download JSON", button_type="danger", disabled=True)
-replay_btn = pn.widgets.Button(name="Replay", button_type="primary", disabled=True)
-clear_btn = pn.widgets.Button(name="Clear", button_type="default", disabled=True)
-
-events_json = pn.widgets.TextAreaInput(
-    name="Recorded events (JSON)",
-    placeholder="Click Start recording, interact (zoom/pan), then Stop.",
-    height=180,
+start_btn, stop_btn, replay_btn, clear_btn = make_buttons()
+
+# Recordings stay in browser memory; only this short summary is synced
+events_summary = pn.pane.Markdown(
+    "Click Start recording, interact (zoom/pan), then Stop.",
     sizing_mode="stretch_width",
 )
 
@@ -88,44 +40,53 @@ start_btn.js_on_click(
         "start_btn": start_btn,
         "status": status,
     },
-    code="""
-    console.log("[rrweb-demo] Start clicked");
-
-    if (!window.rrweb || typeof rrweb.record !== "function") {
-      status.object = "**Status:** rrweb not loaded (check Network/Console)";
-      alert("rrweb not loaded. Check Network + Console.");
-      return;
-    }
+    code=JS_DEBUG_LOG + JS_LOADERS + """
+    log("[rrweb-demo] Start clicked");
 
-    window.__rrweb_state = window.__rrweb_state || { stopFn: null, events: [] };
-
-    if (window.__rrweb_state.stopFn) {
-      status.object = "**Status:** already recording";
-      return;
-    }
+    function startRecording() {
+      window.__rrweb_state = window.__rrweb_state || { stopFn: null, events: [] };
 
-    window.__rrweb_state.events = [];
-    window.__rrweb_state.stopFn = rrweb.record({
-      emit(event) {
-        window.__rrweb_state.events.push(event);
+      if (window.__rrweb_state.stopFn) {
+        status.object = "**Status:** already recording";
+        return;
       }
-    });
-
-    status.object = "**Status:** 🔴 recording... (zoom/pan now)";
-    start_btn.name = "Recording…";
-    start_btn.button_type = "warning";
 
-    stop_btn.disabled = false;
-    replay_btn.disabled = true;
-    clear_btn.disabled = true;
+      window.__rrweb_state.events = [];
+      window.__rrweb_state.stopFn = rrweb.record({
+        emit(event) {
+          window.__rrweb_state.events.push(event);
+        },
+        // Throttle high-frequency sources (mousemove at 20 Hz, scroll at ~7 Hz)
+        sampling: { mousemove: 50, mouseInteraction: true, scroll: 150, input: "last" },
+      });
+
+      status.object = "**Status:** 🔴 recording... (zoom/pan now)";
+      start_btn.name = "Recording…";
+      start_btn.button_type = "warning";
+
+      stop_btn.disabled = false;
+      replay_btn.disabled = true;
+      clear_btn.disabled = true;
+
+      log("[rrweb-demo] Recording started");
+    }
 
-    console.log("[rrweb-demo] Recording started");
+    // rrweb is only downloaded the first time someone records
+    if (!window.rrweb) status.object = "**Status:** loading rrweb…";
+    ensureCss(RRWEB_CSS);
+    ensureScript(RRWEB_URL, () => window.rrweb && typeof rrweb.record === "function")
+      .then(startRecording)
+      .catch((e) => {
+        console.error("[rrweb-demo] Failed to load rrweb", e);
+        status.object = "**Status:** rrweb not loaded (check Network/Console)";
+        alert("rrweb not loaded. Check Network + Console.");
+      });
     """
 )
 
 stop_btn.js_on_click(
     args={
-        "events_json": events_json,
+        "events_summary": events_summary,
         "stop_btn": stop_btn,
         "replay_btn": replay_btn,
         "clear_btn": clear_btn,
@@ -133,8 +94,8 @@ stop_btn.js_on_click(
         "status": status,
         "replay_container": replay_container,
     },
-    code="""
-    console.log("[rrweb-demo] Stop clicked");
+    code=JS_DEBUG_LOG + """
+    log("[rrweb-demo] Stop clicked");
 
     if (!window.__rrweb_state || !window.__rrweb_state.stopFn) {
       status.object = "**Status:** not recording";
@@ -147,7 +108,9 @@ stop_btn.js_on_click(
     const events = window.__rrweb_state.events || [];
     const json = JSON.stringify(events);
 
-    events_json.value = json;
+    // Only a summary is synced, so the recording never crosses the
+    // WebSocket; replay reads the events from browser memory
+    events_summary.object = `Recorded: ${events.length} events, ${(json.length / 1048576).toFixed(2)}MB (kept in browser memory, downloaded to file)`;
 
     // download JSON
     const blob = new Blob([json], { type: "application/json" });
@@ -176,15 +139,15 @@ stop_btn.js_on_click(
     `;
 
 
-    console.log("[rrweb-demo] Stopped. Events:", events.length);
+    log("[rrweb-demo] Stopped. Events:", events.length);
     """
 )
 
 
 replay_btn.js_on_click(
-    args={"events_json": events_json, "status": status, "replay_container": replay_container},
-    code="""
-    console.log("[rrweb-demo] Replay clicked");
+    args={"status": status, "replay_container": replay_container},
+    code=JS_DEBUG_LOG + JS_SHADOW_DOM + """
+    log("[rrweb-demo] Replay clicked");
 
     if (!window.rrweb || typeof rrweb.Replayer !== "function") {
       status.object = "**Status:** rrweb replayer not available (check Console/Network)";
@@ -192,35 +155,28 @@ replay_btn.js_on_click(
       return;
     }
 
-    let events = [];
-    try {
-      events = JSON.parse(events_json.value || "[]");
-    } catch (e) {
-      status.object = "**Status:** JSON parse error";
-      console.error(e);
-      return;
-    }
+    const events = (window.__rrweb_state && window.__rrweb_state.events) || [];
 
     if (!events.length) {
       status.object = "**Status:** no events to replay";
       return;
     }
 
-    // Replace the container with a fresh empty root
+    // Replace the container with a fresh empty root; the per-click id keeps
+    // the lookup below from matching the root left over from a previous replay
+    const rootId = String(Date.now());
     replay_container.object = `
       <div data-rrweb-replay="1"
            style="height:420px; border:1px solid #ddd; border-radius:8px; overflow:hidden;">
-        <div data-rrweb-root="1" style="height:100%;"></div>
+        <div data-rrweb-root="${rootId}" style="height:100%;"></div>
       </div>
     `;
 
-    // Wait for Panel to render the updated HTML, then locate within the document
-    setTimeout(() => {
-      const outer = document.querySelector('[data-rrweb-replay="1"]');
-      const root = outer ? outer.querySelector('[data-rrweb-root="1"]') : null;
+    // Panel renders HTML pane content into the pane's shadow root
+    const findRoot = () => queryAllDOMs(document, `[data-rrweb-root="${rootId}"]`)[0] || null;
 
-      console.log("[rrweb-demo] replay outer:", outer);
-      console.log("[rrweb-demo] replay root:", root);
+    function startReplay(root) {
+      log("[rrweb-demo] replay root:", root);
 
       if (!root) {
         status.object = "**Status:** replay root not found (check Console)";
@@ -238,16 +194,40 @@ replay_btn.js_on_click(
       const replayer = new rrweb.Replayer(events, { root });
       window.__rrweb_replayer = replayer;
       replayer.play();
-    }, 200);
+    }
+
+    // Start as soon as Panel has rendered the updated HTML (which may already
+    // have happened synchronously), giving up after 2 s. The update happens
+    // inside the pane's shadow root, so every open root is observed.
+    const ready = findRoot();
+    if (ready) {
+      startReplay(ready);
+    } else {
+      let fallback = null;
+      const obs = new MutationObserver(() => {
+        const root = findRoot();
+        if (!root) return;
+        obs.disconnect();
+        clearTimeout(fallback);
+        startReplay(root);
+      });
+      for (const r of shadowRoots(document)) {
+        obs.observe(r, { childList: true, subtree: true });
+      }
+      fallback = setTimeout(() => {
+        obs.disconnect();
+        startReplay(findRoot());
+      }, 2000);
+    }
     """
 )
 
 
 
 clear_btn.js_on_click(
-    args={"events_json": events_json, "replay_btn": replay_btn, "clear_btn": clear_btn, "status": status, "replay_container": replay_container},
+    args={"events_summary": events_summary, "replay_btn": replay_btn, "clear_btn": clear_btn, "status": status, "replay_container": replay_container},
     code="""
-    events_json.value = "";
+    events_summary.object = "No events recorded";
     replay_btn.disabled = true;
     clear_btn.disabled = true;
 
@@ -275,7 +255,7 @@ pn.template.FastListTemplate(
         status,
         replay_container,
         plot,
-        events_json,
+        events_summary,
     ],
 ).servable()
 
@@ -1,9 +1,13 @@
 (() => {
-  console.log("demo.js: Script loaded!");
+  // Verbose logging only when the page is opened with ?debug
+  const DEBUG = new URLSearchParams(location.search).has("debug");
+  const log = DEBUG ? console.log.bind(console) : () => {};
+
+  log("demo.js: Script loaded!");
 
   // Use MutationObserver to watch for elements being added to DOM
   function waitForElements() {
-    console.log("Waiting for elements to be added to DOM...");
+    log("Waiting for elements to be added to DOM...");
     
     const checkAndInit = () => {
       const rrwebStatus = document.querySelector("#rrweb-status");
@@ -13,12 +17,12 @@
       const zoomIndicator = document.querySelector("#zoom-indicator");
       
       if (rrwebStatus && rrwebStart && rrwebStop && demoViewer) {
-        console.log("✓ All required elements found!");
-        console.log("  - rrweb-status:", rrwebStatus);
-        console.log("  - rrweb-start:", rrwebStart);
-        console.log("  - rrweb-stop:", rrwebStop);
-        console.log("  - demo-viewer:", demoViewer);
-        console.log("  - zoom-indicator:", zoomIndicator || "not found (optional)");
+        log("✓ All required elements found!");
+        log("  - rrweb-status:", rrwebStatus);
+        log("  - rrweb-start:", rrwebStart);
+        log("  - rrweb-stop:", rrwebStop);
+        log("  - demo-viewer:", demoViewer);
+        log("  - zoom-indicator:", zoomIndicator || "not found (optional)");
         return true;
       }
       return false;
@@ -30,13 +34,14 @@
       return;
     }
     
-    // Set up MutationObserver to watch for DOM changes
-    let attemptCount = 0;
-    const maxAttempts = 300;
+    // Set up MutationObserver to watch for DOM changes; it fires as soon as
+    // the elements are inserted, so no polling is needed
+    const timeoutMs = 30000;
     
     const observer = new MutationObserver((mutations) => {
       if (checkAndInit()) {
         observer.disconnect();
+        clearTimeout(timeout);
         initializeAll();
       }
     });
@@ -47,36 +52,22 @@
       attributes: false
     });
     
-    // Also do periodic checks as fallback
-    const fallbackInterval = setInterval(() => {
-      attemptCount++;
-      
-      if (attemptCount % 10 === 0) {
-        console.log(`Attempt ${attemptCount}: Still waiting...`);
-        console.log("  Current IDs in page:", Array.from(document.querySelectorAll("[id]")).map(e => e.id).slice(0, 20));
-      }
-      
-      if (checkAndInit()) {
-        clearInterval(fallbackInterval);
-        observer.disconnect();
-        initializeAll();
-      } else if (attemptCount >= maxAttempts) {
-        console.error("✗ Timeout after", maxAttempts, "attempts");
-        console.error("All IDs found:", Array.from(document.querySelectorAll("[id]")).map(e => e.id));
-        clearInterval(fallbackInterval);
-        observer.disconnect();
-      }
-    }, 100);
+    // Give up if the elements never show up
+    const timeout = setTimeout(() => {
+      observer.disconnect();
+      console.error("✗ Timeout after", timeoutMs, "ms");
+      console.error("All IDs found:", Array.from(document.querySelectorAll("[id]")).map(e => e.id));
+    }, timeoutMs);
   }
 
   function initializeAll() {
-    console.log("Starting initialization...");
+    log("Starting initialization...");
     initRrweb();
     initPanzoom();
   }
 
   function initRrweb() {
-    console.log("initRrweb: Starting...");
+    log("initRrweb: Starting...");
     
     const statusEl = document.querySelector("#rrweb-status");
     const startBtn = document.querySelector("#rrweb-start");
@@ -92,49 +83,76 @@
     };
 
     if (!window.rrweb || typeof window.rrweb.record !== "function") {
-      console.log("rrweb: library not loaded yet, waiting...");
+      log("rrweb: library not loaded yet, waiting...");
       setStatus("rrweb loading…");
       setTimeout(initRrweb, 500);
       return;
     }
 
-    console.log("rrweb: Initializing...");
+    log("rrweb: Initializing...");
 
     let stopFn = null;
-    let events = [];
+    // Events are serialized as they arrive, so stopping only joins strings
+    let chunks = [];
 
     const nowIso = () => new Date().toISOString().replace(/[:.]/g, "-");
 
-    const downloadEvents = () => {
-      const payload = {
-        created_at: new Date().toISOString(),
-        user_agent: navigator.userAgent,
-        url: location.href,
-        rrweb_events: events,
-      };
-      const blob = new Blob([JSON.stringify(payload, null, 2)], { type: "application/json" });
+    const saveBlob = (blob, filename) => {
       const url = URL.createObjectURL(blob);
       const a = document.createElement("a");
       a.href = url;
-      a.download = `rrweb-recording-${nowIso()}.json`;
+      a.download = filename;
       document.body.appendChild(a);
       a.click();
       a.remove();
       setTimeout(() => URL.revokeObjectURL(url), 250);
     };
 
+    const downloadEvents = () => {
+      const meta = JSON.stringify({
+        created_at: new Date().toISOString(),
+        user_agent: navigator.userAgent,
+        url: location.href,
+      });
+      // Hand the pieces to Blob directly instead of building one huge string
+      const parts = [meta.slice(0, -1) + ',"rrweb_events":['];
+      for (let i = 0; i < chunks.length; i++) {
+        if (i) parts.push(",");
+        parts.push(chunks[i]);
+      }
+      parts.push("]}");
+      const blob = new Blob(parts, { type: "application/json" });
+      const filename = `rrweb-recording-${nowIso()}.json`;
+
+      if (typeof CompressionStream !== "function") {
+        saveBlob(blob, filename);
+        return;
+      }
+      // rrweb events repeat the same shapes over and over, so gzip (native in
+      // the browser) typically makes the file 5-10x smaller
+      new Response(blob.stream().pipeThrough(new CompressionStream("gzip")))
+        .blob()
+        .then((gz) => saveBlob(gz, `${filename}.gz`))
+        .catch((e) => {
+          console.warn("rrweb: gzip failed, saving uncompressed JSON", e);
+          saveBlob(blob, filename);
+        });
+    };
+
     const startRecording = () => {
       if (stopFn) return;
-      events = [];
+      chunks = [];
       setStatus("recording…");
-      console.log("rrweb: Recording started");
+      log("rrweb: Recording started");
       stopFn = window.rrweb.record({
         emit: (event) => {
-          events.push(event);
-          if (events.length % 50 === 0) {
-            console.log(`rrweb: ${events.length} events captured`);
+          chunks.push(JSON.stringify(event));
+          if (chunks.length % 50 === 0) {
+            log(`rrweb: ${chunks.length} events captured`);
           }
         },
+        // Throttle high-frequency sources (mousemove at 20 Hz, scroll at ~7 Hz)
+        sampling: { mousemove: 50, mouseInteraction: true, scroll: 150, input: "last" },
       });
     };
 
@@ -142,22 +160,22 @@
       if (!stopFn) return;
       stopFn();
       stopFn = null;
-      setStatus(`stopped (${events.length} events)`);
-      console.log(`rrweb: Recording stopped. Total events: ${events.length}`);
+      setStatus(`stopped (${chunks.length} events)`);
+      log(`rrweb: Recording stopped. Total events: ${chunks.length}`);
       downloadEvents();
     };
 
-    window.__rrweb_demo = { start: startRecording, stop: stopRecording, getEvents: () => events };
+    window.__rrweb_demo = { start: startRecording, stop: stopRecording, getEvents: () => chunks.map((c) => JSON.parse(c)) };
 
     startBtn.addEventListener("click", startRecording);
     stopBtn.addEventListener("click", stopRecording);
 
-    console.log("rrweb: Initialization complete. Auto-starting in 300ms...");
+    log("rrweb: Initialization complete. Auto-starting in 300ms...");
     setTimeout(startRecording, 300);
   }
 
   function initPanzoom() {
-    console.log("initPanzoom: Starting...");
+    log("initPanzoom: Starting...");
 
     const viewer = document.querySelector("#demo-viewer");
     if (!viewer) {
@@ -167,18 +185,25 @@
 
     const svg = viewer.querySelector("svg");
     if (!svg) {
-      console.log("panzoom: SVG element not found in viewer, waiting...");
-      setTimeout(initPanzoom, 500);
+      log("panzoom: SVG element not found in viewer, waiting...");
+      // Retry the moment the SVG is inserted instead of polling for it
+      const observer = new MutationObserver(() => {
+        if (viewer.querySelector("svg")) {
+          observer.disconnect();
+          initPanzoom();
+        }
+      });
+      observer.observe(viewer, { childList: true, subtree: true });
       return;
     }
 
     if (typeof window.Panzoom !== "function") {
-      console.log("panzoom: library not loaded yet, waiting...");
+      log("panzoom: library not loaded yet, waiting...");
       setTimeout(initPanzoom, 500);
       return;
     }
 
-    console.log("panzoom: Initializing...");
+    log("panzoom: Initializing...");
 
     svg.style.width = "100%";
     svg.style.height = "100%";
@@ -194,13 +219,38 @@
       startY: 0,
     });
 
+    // Keep the SVG on its own compositor layer while it is moving, so zoom
+    // and pan steps transform a cached bitmap instead of repainting it. The
+    // hint is dropped once movement settles so the SVG re-rasterizes sharply.
+    let settleTimer = null;
+    svg.addEventListener("panzoomchange", () => {
+      svg.style.willChange = "transform";
+      clearTimeout(settleTimer);
+      settleTimer = setTimeout(() => { svg.style.willChange = ""; }, 300);
+    });
+
+    // Trackpads can fire well over 100 wheel events a second; fold them into
+    // one zoom per animation frame, stepping the scale like zoomWithWheel does
+    let pendingScale = null;
+    let pendingPoint = null;
     viewer.addEventListener("wheel", (e) => {
       e.preventDefault();
-      panzoom.zoomWithWheel(e);
+      if (pendingScale === null) {
+        pendingScale = panzoom.getScale();
+        requestAnimationFrame(() => {
+          panzoom.zoomToPoint(pendingScale, pendingPoint);
+          pendingScale = null;
+        });
+      }
+      const delta = e.deltaY === 0 && e.deltaX ? e.deltaX : e.deltaY;
+      const { step, minScale, maxScale } = panzoom.getOptions();
+      pendingScale *= Math.exp((delta < 0 ? 1 : -1) * step / 3);
+      pendingScale = Math.min(maxScale, Math.max(minScale, pendingScale));
+      pendingPoint = { clientX: e.clientX, clientY: e.clientY };
     }, { passive: false });
     
     viewer.addEventListener("dblclick", () => {
-      console.log("panzoom: Reset view");
+      log("panzoom: Reset view");
       panzoom.reset();
     });
     svg.addEventListener("mousedown", () => {
@@ -219,7 +269,7 @@
     }
 
     window.__demo_panzoom = panzoom;
-    console.log("panzoom: Initialization complete");
+    log("panzoom: Initialization complete");
   }
 
   if (document.readyState === "loading") {
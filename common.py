@@ -0,0 +1,257 @@
+"""Pieces shared by the Panel + Bokeh + rrweb demo apps.
+
+`panel serve` re-executes an app script for every session, but imported
+modules are cached per process, so the image below is downloaded and
+decoded at most once per process rather than once per session, and only
+once a session actually renders the plot. Panel and Bokeh objects cannot
+be shared between sessions, so those are built by the make_* factories.
+"""
+import functools
+import hashlib
+import io
+import os
+import time
+import urllib.parse
+from pathlib import Path
+
+import numpy as np
+import panel as pn
+import urllib3
+from bokeh.models import WheelZoomTool, PanTool, ResetTool, BoxZoomTool
+from bokeh.plotting import figure
+from PIL import Image
+
+IMAGE_URL = "https://assets.holoviz.org/panel/tutorials/wind_turbine.png"
+# Largest image (w, h) shipped to the browser; bigger images are downscaled
+MAX_IMAGE_SIZE = (1600, 1200)
+
+# Downloaded assets are kept here so worker restarts skip the network
+CACHE_DIR = Path.home() / ".cache" / "panel-rrweb-demo"
+# Cached files older than this are fetched (or rebuilt) again, so a changed
+# upstream image is picked up eventually
+CACHE_MAX_AGE = 7 * 24 * 3600
+
+# One pooled client per process, so repeated fetches reuse TLS connections
+_http = urllib3.PoolManager(retries=urllib3.Retry(3, backoff_factor=0.3))
+
+# rrweb and rrweb-player, pinned to the releases the npm "latest" tags point
+# at (rrweb 2.0.0-alpha.4, rrweb-player 1.0.0-alpha.4), which the bundled
+# rrweb-session*.json recordings were made with. jsDelivr serves exact
+# versions as immutable, so the browser cache never has to revalidate them.
+RRWEB_VERSION = "2.0.0-alpha.4"
+RRWEB_PLAYER_VERSION = "1.0.0-alpha.4"
+RRWEB_URL = f"https://cdn.jsdelivr.net/npm/rrweb@{RRWEB_VERSION}/dist/rrweb.min.js"
+RRWEB_CSS = f"https://cdn.jsdelivr.net/npm/rrweb@{RRWEB_VERSION}/dist/rrweb.min.css"
+RRWEB_PLAYER_URL = f"https://cdn.jsdelivr.net/npm/rrweb-player@{RRWEB_PLAYER_VERSION}/dist/index.js"
+RRWEB_PLAYER_CSS = f"https://cdn.jsdelivr.net/npm/rrweb-player@{RRWEB_PLAYER_VERSION}/dist/style.css"
+
+# Prepended to the apps' JS callbacks: defines DEBUG and a log() that is a
+# no-op unless the page was opened with ?debug
+JS_DEBUG_LOG = """
+    const DEBUG = new URLSearchParams(location.search).has("debug");
+    const log = DEBUG ? console.log.bind(console) : () => {};
+"""
+
+# Prepended to JS callbacks that look inside Bokeh/Panel components. Those
+# render into nested open shadow roots, which querySelectorAll (and a
+# MutationObserver on document.body) cannot see into, so walk them the way
+# searchAllDOMs in Panel's panel/models/html.ts does.
+JS_SHADOW_DOM = """
+    const shadowRoots = (root) => {
+      const roots = [root];
+      for (let i = 0; i < roots.length; i++) {
+        for (const el of roots[i].querySelectorAll("*")) {
+          if (el.shadowRoot) roots.push(el.shadowRoot);
+        }
+      }
+      return roots;
+    };
+    const queryAllDOMs = (root, selector) =>
+      shadowRoots(root).flatMap((r) => Array.from(r.querySelectorAll(selector)));
+"""
+
+
+# Prepended (after JS_DEBUG_LOG, whose log() they use) to JS callbacks that
+# load rrweb assets on demand: the pinned URLs above, ensureCss, which adds a
+# stylesheet once per page, and ensureScript, which resolves once checkFn()
+# passes, reusing an in-flight <script>.
+JS_LOADERS = f"""
+    const RRWEB_URL = "{RRWEB_URL}";
+    const RRWEB_CSS = "{RRWEB_CSS}";
+    const RRWEB_PLAYER_URL = "{RRWEB_PLAYER_URL}";
+    const RRWEB_PLAYER_CSS = "{RRWEB_PLAYER_CSS}";
+""" + """
+    // Hrefs already on the page, shared by every callback that loads CSS
+    window.__rrweb_css = window.__rrweb_css || new Set();
+    function ensureCss(href) {
+      if (window.__rrweb_css.has(href)) return;
+      window.__rrweb_css.add(href);
+      if (document.querySelector(`link[rel="stylesheet"][href="${href}"]`)) return;
+      const link = document.createElement("link");
+      link.rel = "stylesheet";
+      link.href = href;
+      document.head.appendChild(link);
+      log("[rrweb-demo] Added CSS:", href);
+    }
+
+    function ensureScript(src, checkFn) {
+      return new Promise((resolve, reject) => {
+        try {
+          if (checkFn()) {
+            log("[rrweb-demo] Script already loaded:", src);
+            return resolve(true);
+          }
+          if (document.querySelector(`script[src="${src}"]`)) {
+            log("[rrweb-demo] Script tag exists, waiting for load:", src);
+            const t0 = Date.now();
+            const tick = () => {
+              if (checkFn()) {
+                log("[rrweb-demo] Script now available:", src);
+                return resolve(true);
+              }
+              if (Date.now() - t0 > 8000) {
+                console.error("[rrweb-demo] Timeout loading:", src);
+                return reject(new Error("Timed out loading " + src));
+              }
+              setTimeout(tick, 100);
+            };
+            return tick();
+          }
+          log("[rrweb-demo] Loading script:", src);
+          const s = document.createElement("script");
+          s.src = src;
+          s.async = true;
+          s.onload = () => {
+            log("[rrweb-demo] Script loaded successfully:", src);
+            resolve(true);
+          };
+          s.onerror = () => {
+            console.error("[rrweb-demo] Failed to load script:", src);
+            s.remove();  // so the next click requests it again
+            reject(new Error("Failed to load " + src));
+          };
+          document.head.appendChild(s);
+        } catch (e) {
+          console.error("[rrweb-demo] Error in ensureScript:", e);
+          reject(e);
+        }
+      });
+    }
+"""
+
+
+def _write_cached(path, write):
+    """Create path by calling write(f) on a temp file, then renaming it
+
+    The rename means concurrent workers never read a partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+    tmp.replace(path)
+
+
+def _is_fresh(path):
+    """True if path exists and is younger than CACHE_MAX_AGE"""
+    try:
+        return time.time() - path.stat().st_mtime < CACHE_MAX_AGE
+    except FileNotFoundError:
+        return False
+
+
+def _fetch_cached(url):
+    """Return the bytes at url, downloading them only on a cache miss
+
+    Files are keyed on a hash of the full URL, so two URLs that share a
+    basename (or differ only in the query string) never collide.
+    """
+    key = hashlib.sha1(url.encode()).hexdigest()[:16]
+    path = CACHE_DIR / f"{key}-{Path(urllib.parse.urlparse(url).path).name}"
+    if _is_fresh(path):
+        return path.read_bytes()
+    resp = _http.request("GET", url)
+    if resp.status != 200:
+        raise urllib3.exceptions.HTTPError(f"GET {url} returned HTTP {resp.status}")
+    data = resp.data
+    _write_cached(path, lambda f: f.write(data))
+    return data
+
+
+@functools.lru_cache(maxsize=1)
+def _load_rgba(url):
+    """Load the image at url as a bottom-up (h, w) uint32 RGBA array
+
+    The decoded array is cached as .npy and memory-mapped on later loads, so
+    warm starts skip the PNG decode and all workers on a host share one copy
+    of the pixels through the page cache.
+    """
+    key = hashlib.sha1(f"{url}|{MAX_IMAGE_SIZE}".encode()).hexdigest()[:16]
+    npy_path = CACHE_DIR / f"rgba-{key}.npy"
+    if _is_fresh(npy_path):
+        return np.load(npy_path, mmap_mode="r")
+
+    img = Image.open(io.BytesIO(_fetch_cached(url))).convert("RGBA")
+    img.thumbnail(MAX_IMAGE_SIZE, Image.LANCZOS)
+    arr = np.asarray(img, dtype=np.uint8)
+    h, w = arr.shape[:2]
+
+    # Flip into one contiguous buffer up front; Bokeh would otherwise copy the
+    # strided view every time it serializes the image for a new session.
+    rgba = np.ascontiguousarray(arr[::-1]).view(np.uint32).reshape((h, w))
+    _write_cached(npy_path, lambda f: np.save(f, rgba))
+    return rgba
+
+
+def make_plot():
+    """Build the pan/zoom image viewer for one session"""
+    rgba = _load_rgba(IMAGE_URL)
+    h, w = rgba.shape
+    wheel_zoom = WheelZoomTool()
+    pan = PanTool()
+    box_zoom = BoxZoomTool()
+    reset = ResetTool()
+
+    p = figure(
+        title="Panel + Bokeh Image Viewer",
+        x_range=(0, w),
+        y_range=(0, h),
+        width=900,
+        height=650,
+        match_aspect=True,
+        toolbar_location="above",
+        tools="",
+    )
+    p.image_rgba(image=[rgba], x=0, y=0, dw=w, dh=h)
+    p.add_tools(wheel_zoom, pan, box_zoom, reset)
+    p.toolbar.active_scroll = wheel_zoom
+    p.toolbar.active_drag = pan
+    p.xaxis.visible = False
+    p.yaxis.visible = False
+    p.grid.visible = False
+
+    return pn.pane.Bokeh(p, sizing_mode="stretch_both")
+
+
+def make_lazy_plot():
+    """Return a placeholder that is filled with make_plot() once the page loads
+
+    Idle workers (e.g. under --num-procs) then never fetch or decode the image.
+    """
+    container = pn.Column(sizing_mode="stretch_both", min_height=650, loading=True)
+
+    def _fill():
+        container[:] = [make_plot()]
+        container.loading = False
+
+    pn.state.onload(_fill)
+    return container
+
+
+def make_buttons():
+    """Build the (start, stop, replay, clear) recording buttons for one session"""
+    start_btn = pn.widgets.Button(name="Start recording", button_type="success")
+    stop_btn = pn.widgets.Button(name="Stop + download JSON", button_type="danger", disabled=True)
+    replay_btn = pn.widgets.Button(name="Replay", button_type="primary", disabled=True)
+    clear_btn = pn.widgets.Button(name="Clear", button_type="default", disabled=True)
+    return start_btn, stop_btn, replay_btn, clear_btn